@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import JSONResponse
 import os
 import sys
 from pathlib import Path
 
+from routes.generate import prewarmer
+from utils.gemini_langchain_services import gemini_breaker, gemini_background_breaker
+from utils.resilience import gtts_breaker, gtts_background_breaker
+from utils.profiling import request_profiler, PROFILE_TOKEN_HEADER
+
 router = APIRouter()
 
 @router.get("/")
@@ -27,8 +32,42 @@ async def debug_info():
                 "audio_count": len(audio_files),
                 "recent_images": [f.name for f in sorted(image_files, key=lambda x: x.stat().st_mtime, reverse=True)[:5]],
                 "recent_audio": [f.name for f in sorted(audio_files, key=lambda x: x.stat().st_mtime, reverse=True)[:5]]
+            },
+            "prewarm": prewarmer.status(),
+            "circuits": {
+                "gemini": gemini_breaker.state,
+                "gtts": gtts_breaker.state,
+                "gemini_background": gemini_background_breaker.state,
+                "gtts_background": gtts_background_breaker.state
             }
         }
     except Exception as e:
         print(f"Error in debug route: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def require_profile_token(request: Request):
+    # Profiles expose source paths, line numbers and timings, so they need the same token as triggering
+    if not request_profiler.token_matches(request.headers.get(PROFILE_TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Missing or invalid profile token")
+
+@router.get("/profiles")
+async def list_profiles(request: Request):
+    # Recent profiled requests (header-triggered or sampled and slow), newest first
+    require_profile_token(request)
+    return {
+        "success": True,
+        "sample_rate": request_profiler.sample_rate,
+        "slow_ms": request_profiler.slow_ms,
+        "profiles": request_profiler.list_profiles()
+    }
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: int):
+    require_profile_token(request)
+    profile = request_profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return {
+        "success": True,
+        "profile": profile
+    }
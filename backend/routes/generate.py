@@ -1,16 +1,81 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
 import time
 import os
 
 # Import our story generation service
-from utils.gemini_langchain_services import generate_story_and_audio
+from utils.gemini_langchain_services import (
+    generate_story_from_image, generate_audio_from_text, UPLOAD_DIR, gemini_background_breaker
+)
+from utils.story_prewarm import StoryPrewarmer, image_digest
+from utils.resilience import Deadline, DeadlineExceeded, CircuitOpenError, gtts_breaker, gtts_background_breaker
+from utils.audio_store import AudioStore
+from utils.profiling import request_profiler, stage, PROFILE_HEADER, PROFILE_TOKEN_HEADER
 
 router = APIRouter()
 
+# Story audio is synthesized on first fetch of its URL (or in the background with AUDIO_PRESYNTHESIS)
+audio_store = AudioStore(
+    generate_audio_from_text,
+    UPLOAD_DIR,
+    background_synthesize_fn=lambda text, **kwargs: generate_audio_from_text(text, breaker=gtts_background_breaker, **kwargs)
+)
+
+def generate_story_variant(image_path_str: str, deadline=None, presynthesize=None, breaker=None) -> dict:
+    """
+    Generates a story for an image and registers it for deferred audio synthesis.
+    """
+    story = generate_story_from_image(image_path_str, deadline=deadline, breaker=breaker)
+    with stage("register_audio"):
+        audio_id = audio_store.register(story, presynthesize=presynthesize)
+    return {
+        "story": story,
+        "audioId": audio_id
+    }
+
+def prewarm_story_variant(image_path_str: str) -> dict:
+    # Prewarmed variants are served instantly, so their audio is synthesized before pooling.
+    # Runs on the background breakers with its own budget so it never holds foreground capacity.
+    deadline = Deadline.from_env('PREWARM_DEADLINE_SECONDS', 60)
+    variant = generate_story_variant(image_path_str, deadline=deadline, presynthesize=False, breaker=gemini_background_breaker)
+    audio_store.get_audio_path(variant["audioId"], deadline=deadline, background=True)
+    return variant
+
+# Keeps ready story variants for frequently requested images (opt-in via PREWARM_ENABLED)
+prewarmer = StoryPrewarmer(prewarm_story_variant)
+
+def save_and_generate(file_path: Path, content: bytes, deadline, profile_header=None, profile_token=None) -> dict:
+    """
+    Saves an uploaded image and returns a story variant for it, from the prewarm pool if possible.
+    Blocking; runs in the threadpool so a slow or hung provider never stalls the event loop.
+    """
+    # Profile this request if asked to via header or picked by the sampling rate; started here so
+    # the profiler and stack sampler cover the worker thread doing the work
+    with request_profiler.profile_request("/api/generate", profile_header, profile_token):
+        # Save uploaded file
+        with stage("save_upload"), open(file_path, "wb") as buffer:
+            buffer.write(content)
+    
+        print(f"Image saved to {file_path}")
+    
+        # Serve a prewarmed variant for hot images, otherwise generate the story
+        digest = image_digest(content)
+        with prewarmer.foreground():
+            prewarmer.record_request(digest, str(file_path))
+            with stage("prewarm_lookup"):
+                result = prewarmer.take_variant(digest)
+            if result is not None:
+                print(f"Serving prewarmed story for image {digest[:12]}")
+            else:
+                result = generate_story_variant(str(file_path), deadline=deadline)
+        return result
+
 @router.post("/")
-async def generate_story(file: UploadFile = File(...)):
+async def generate_story(request: Request, file: UploadFile = File(...)):
+    # Per-request time budget, propagated into the LLM and TTS calls
+    deadline = Deadline.from_env()
     try:
         # Generate a timestamp for the filename
         timestamp = int(time.time() * 1000)
@@ -18,23 +83,24 @@ async def generate_story(file: UploadFile = File(...)):
         file_extension = Path(original_filename).suffix
         filename = f"image-{timestamp}{file_extension}"
         
-        # Save the uploaded file
         upload_dir = Path(__file__).parent.parent / "uploads"
         file_path = upload_dir / filename
         
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        print(f"Image saved to {file_path}")
-        
-        # Generate story and audio
-        result = generate_story_and_audio(str(file_path))
+        content = await file.read()
+        result = await run_in_threadpool(
+            save_and_generate,
+            file_path,
+            content,
+            deadline,
+            request.headers.get(PROFILE_HEADER),
+            request.headers.get(PROFILE_TOKEN_HEADER)
+        )
         
-        # Prepare response - convert audio path to relative URL
-        audio_filename = Path(result["audioPath"]).name
-        audio_url = f"/uploads/{audio_filename}"
+        # Respond as soon as the story is ready; audio resolves lazily from this URL.
+        # While TTS is unhealthy, degrade to a text-only response unless the audio already exists.
+        audio_url = None
+        if gtts_breaker.state != 'open' or audio_store.has_audio(result['audioId']):
+            audio_url = f"/api/generate/audio/{result['audioId']}"
         
         return {
             "success": True,
@@ -42,6 +108,35 @@ async def generate_story(file: UploadFile = File(...)):
             "audioUrl": audio_url
         }
         
+    except DeadlineExceeded as e:
+        print(f"Story generation timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpenError as e:
+        print(f"Story generation unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Error generating story: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/audio/{audio_id}")
+def get_story_audio(request: Request, audio_id: str):
+    # Sync handler: runs in the threadpool so concurrent fetches can wait on one synthesis
+    deadline = Deadline.from_env()
+    try:
+        # Text-to-speech runs here on first fetch, so profile it like a generation
+        with request_profiler.profile_request(
+            "/api/generate/audio", request.headers.get(PROFILE_HEADER), request.headers.get(PROFILE_TOKEN_HEADER)
+        ):
+            audio_path = audio_store.get_audio_path(audio_id, deadline=deadline)
+        return FileResponse(audio_path, media_type="audio/mpeg")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except DeadlineExceeded as e:
+        print(f"Audio synthesis timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpenError as e:
+        print(f"Audio synthesis unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        print(f"Error synthesizing audio: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
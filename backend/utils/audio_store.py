@@ -0,0 +1,152 @@
+import os
+import re
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from utils.resilience import Deadline, DeadlineExceeded
+
+# Deferred text-to-speech for generated stories.
+# Stories are registered as text; audio is synthesized on first fetch (or in the background
+# when AUDIO_PRESYNTHESIS is set) and cached on disk next to the uploads.
+
+AUDIO_ID_PATTERN = re.compile(r'^[0-9a-f]{24}$')
+
+class AudioStore:
+    """
+    Resolves story audio lazily, synthesizing each story at most once.
+
+    Args:
+        synthesize_fn: Callable (text, deadline=None, audio_file_name=None) -> saved audio path
+        upload_dir: Directory holding story text and audio files
+        presynthesize: Synthesize audio in the background on register (AUDIO_PRESYNTHESIS, default: off)
+        background_synthesize_fn: Synthesis callable for background work (default: synthesize_fn)
+        max_pending: Background syntheses queued at once; further ones are skipped (AUDIO_PRESYNTHESIS_MAX_PENDING, default: 16)
+    """
+
+    def __init__(self, synthesize_fn, upload_dir, presynthesize=None, background_synthesize_fn=None, max_pending=None):
+        self.synthesize_fn = synthesize_fn
+        self.background_synthesize_fn = background_synthesize_fn or synthesize_fn
+        self.upload_dir = Path(upload_dir)
+        self.presynthesize = presynthesize if presynthesize is not None else os.getenv('AUDIO_PRESYNTHESIS', '').lower() in ('1', 'true', 'yes')
+        self._lock = threading.Lock()
+        self._inflight = {}  # audio id -> Future resolving to the audio path
+        self._pending = set()  # audio ids queued for background synthesis
+        if max_pending is None:
+            try:
+                max_pending = int(os.getenv('AUDIO_PRESYNTHESIS_MAX_PENDING', 16))
+            except ValueError:
+                max_pending = 16
+        self.max_pending = max(0, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-presynth')
+
+    def register(self, text: str, presynthesize=None) -> str:
+        """
+        Stores story text for later synthesis and returns its audio id.
+        """
+        audio_id = hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]
+        text_path = self._text_path(audio_id)
+        if not text_path.exists():
+            self.upload_dir.mkdir(parents=True, exist_ok=True)
+            text_path.write_text(text, encoding='utf-8')
+
+        if presynthesize if presynthesize is not None else self.presynthesize:
+            self._queue_presynthesis(audio_id)
+        return audio_id
+
+    def has_audio(self, audio_id: str) -> bool:
+        """
+        Returns True if the story's audio has already been synthesized.
+        """
+        return self._audio_path(audio_id).exists()
+
+    def get_audio_path(self, audio_id: str, deadline=None, background=False) -> str:
+        """
+        Returns the audio file path for a story, synthesizing it on first use.
+
+        Concurrent calls for the same story share a single synthesis. Background callers
+        synthesize with background_synthesize_fn. Raises FileNotFoundError if the id is unknown.
+        """
+        if not AUDIO_ID_PATTERN.match(audio_id):
+            raise FileNotFoundError(f'Unknown audio id: {audio_id}')
+
+        audio_path = self._audio_path(audio_id)
+        if audio_path.exists():
+            return str(audio_path)
+
+        with self._lock:
+            future = self._inflight.get(audio_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[audio_id] = future
+
+        if not owner:
+            try:
+                return future.result(timeout=deadline.remaining() if deadline is not None else None)
+            except FutureTimeoutError:
+                raise DeadlineExceeded(f'Audio for {audio_id} was not ready in time')
+
+        try:
+            path = self._synthesize(audio_id, deadline, background)
+            future.set_result(path)
+            return path
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(audio_id, None)
+
+    def _synthesize(self, audio_id: str, deadline, background: bool) -> str:
+        audio_path = self._audio_path(audio_id)
+        # Another caller may have finished between the existence check and taking ownership
+        if audio_path.exists():
+            return str(audio_path)
+
+        text_path = self._text_path(audio_id)
+        if not text_path.exists():
+            raise FileNotFoundError(f'Unknown audio id: {audio_id}')
+        text = text_path.read_text(encoding='utf-8')
+
+        # Write to a temporary name unique to this attempt, so a partial file is never served and an
+        # abandoned attempt that keeps writing after its deadline cannot mix into a later one
+        partial_path = self.upload_dir / f'{audio_path.name}.{uuid.uuid4().hex}.part'
+        synthesize_fn = self.background_synthesize_fn if background else self.synthesize_fn
+        try:
+            synthesize_fn(text, deadline=deadline, audio_file_name=partial_path.name)
+            os.replace(partial_path, audio_path)
+        except Exception:
+            partial_path.unlink(missing_ok=True)
+            raise
+        return str(audio_path)
+
+    def _queue_presynthesis(self, audio_id: str):
+        # The deadline starts at submit time so jobs stuck in the queue expire instead of piling up
+        with self._lock:
+            if audio_id in self._pending:
+                return
+            if len(self._pending) >= self.max_pending:
+                print(f'Skipping audio pre-synthesis for {audio_id}: {len(self._pending)} already pending')
+                return
+            self._pending.add(audio_id)
+        self._executor.submit(self._presynthesize, audio_id, Deadline.from_env())
+
+    def _presynthesize(self, audio_id: str, deadline):
+        try:
+            if self.has_audio(audio_id):
+                return
+            deadline.check(f'pre-synthesizing audio {audio_id}')
+            self.get_audio_path(audio_id, deadline=deadline, background=True)
+        except Exception as e:
+            print(f'Error pre-synthesizing audio {audio_id}: {e}')
+        finally:
+            with self._lock:
+                self._pending.discard(audio_id)
+
+    def _text_path(self, audio_id: str) -> Path:
+        return self.upload_dir / f'story-{audio_id}.txt'
+
+    def _audio_path(self, audio_id: str) -> Path:
+        return self.upload_dir / f'story-{audio_id}.mp3'
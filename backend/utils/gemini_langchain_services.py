@@ -2,13 +2,17 @@ import os
 import base64
 import mimetypes
 import io
+import math
 from pathlib import Path
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
-from langchain_core.messages import SystemMessage, HumanMessage
 from gtts import gTTS
 import time
+from functools import lru_cache
 from PIL import Image, ImageDraw
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, gtts_breaker
+from utils.profiling import stage
+from utils.prompt_templates import build_story_messages, get_cached_content_name
 
 # Determine the project's backend root directory for loading .env and saving uploads
 # Assumes this script is in backend/utils/
@@ -16,6 +20,14 @@ BACKEND_DIR = Path(__file__).resolve().parent.parent
 ENV_PATH = BACKEND_DIR / '.env'
 UPLOAD_DIR = BACKEND_DIR / 'uploads'
 
+# Circuit breakers for the LLM; calls fail fast while the service is unhealthy.
+# The gTTS breakers are shared with the other provider modules (see utils.resilience).
+gemini_breaker = CircuitBreaker('gemini')
+
+# Separate single-worker breaker for background work (prewarming), so it never takes
+# foreground workers and its failures never open the foreground circuit
+gemini_background_breaker = CircuitBreaker('gemini-background', max_workers=1)
+
 def image_to_base64(image_path_str: str, max_dimension: int = 800, quality: int = 85) -> str:
     """
     Reads an image file, optimizes it to reduce token size, and converts it to base64 data URI format.
@@ -70,9 +82,27 @@ def image_to_base64(image_path_str: str, max_dimension: int = 800, quality: int
         print(f'Error converting image to base64: {e}')
         raise
 
-def generate_story_from_image(image_path_str: str) -> str:
+@lru_cache(maxsize=4)
+def _get_model(cached_content=None):
+    """
+    Initializes the Gemini chat model once per cached-content setting and reuses it across requests.
+    """
+    model_kwargs = {'cached_content': cached_content} if cached_content else {}
+    # Updated model to gemini-pro-vision for image support
+    model = init_chat_model(
+        'gemini-2.0-flash',
+        model_provider='google_genai',
+        temperature=0.7,
+        max_output_tokens=1024,
+        **model_kwargs
+    )
+    print('Initialized LangChain model with Gemini Vision')
+    return model
+
+def generate_story_from_image(image_path_str: str, deadline=None, breaker=None) -> str:
     """
     Generates a story based on an image using LangChain and Google Gemini Vision model.
+    Calls go through the foreground circuit breaker unless another breaker is given.
     """
     load_dotenv(dotenv_path=ENV_PATH)
     google_api_key = os.getenv('GOOGLE_API_KEY')
@@ -82,7 +112,10 @@ def generate_story_from_image(image_path_str: str) -> str:
         raise ValueError('Missing GOOGLE_API_KEY. Please add it to your .env file in the backend directory.')
         
     try:
-        base64_image = image_to_base64(image_path_str, max_dimension=600, quality=80)
+        if deadline is not None:
+            deadline.check('story generation')
+        with stage('image_to_base64'):
+            base64_image = image_to_base64(image_path_str, max_dimension=600, quality=80)
         print(f'Successfully converted image to base64: {image_path_str}')
         
         base64_size_kb = len(base64_image) / 1024
@@ -91,35 +124,17 @@ def generate_story_from_image(image_path_str: str) -> str:
         if base64_size_kb > 500:
             print(f'WARNING: Image base64 size is quite large ({base64_size_kb:.2f} KB). This may exceed token limits.')
 
-        # Updated model to gemini-pro-vision for image support
-        model = init_chat_model(
-            'gemini-2.0-flash',
-            model_provider='google_genai',
-            temperature=0.7,
-            max_output_tokens=1024
-        )
-        print('Initialized LangChain model with Gemini Vision')
-
-        system_prompt_text = (
-           "You are a creative storyteller that creates imaginative, engaging, and family-friendly short stories "
-            "(around 300 words) based on images. Create a whimsical, positive narrative that captures the "
-            "essence of the image. Your stories should have a clear beginning, middle, and end, with vivid "
-            "descriptions. Avoid any adult, violent, political, or controversial themes. Keep story not more than 100 words."
-        )
-
-        # Extract only the base64 payload from the full data URI
-        base64_payload = base64_image.split(',')[1]
-
-        messages = [
-            SystemMessage(content=system_prompt_text),
-            HumanMessage(content=[
-                {"type": "text", "text": "Generate a creative short story based on this image:"},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_payload}"}}
-            ])
-        ]
+        cached_content = get_cached_content_name('gemini')
+        model = _get_model(cached_content)
+
+        # Image block references the data URI directly; no copy of the payload is made
+        messages = build_story_messages('gemini', base64_image, use_cached_system_prompt=bool(cached_content))
 
         print('Making API call to Google Gemini Vision for story generation...')
-        response = model.invoke(messages)
+        with stage('llm'):
+            # The remaining time also goes to the client so an abandoned call cannot hang a breaker worker
+            timeout = deadline.remaining() if deadline is not None else None
+            response = (breaker or gemini_breaker).call(model.invoke, messages, timeout=timeout, deadline=deadline)
         print('Successfully received response from Google Gemini Vision API.')
         
         del base64_image
@@ -131,20 +146,33 @@ def generate_story_from_image(image_path_str: str) -> str:
         print(f'Error generating story from image: {e}')
         raise
 
-def generate_audio_from_text(text: str) -> str:
+def generate_audio_from_text(text: str, deadline=None, audio_file_name=None, breaker=None) -> str:
     """
     Generates audio from text using gTTS and saves it to the UPLOAD_DIR.
+    A timestamped file name is used unless audio_file_name is given.
+    Calls go through the foreground circuit breaker unless another breaker is given.
     """
     try:
         print('Initializing gTTS for text-to-speech conversion...')
         UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         
-        timestamp = int(time.time() * 1000)
-        audio_file_name = f'story-{timestamp}.mp3'
+        if audio_file_name is None:
+            timestamp = int(time.time() * 1000)
+            audio_file_name = f'story-{timestamp}.mp3'
         audio_file_path = UPLOAD_DIR / audio_file_name
 
-        gtts_obj = gTTS(text=text, lang='en', slow=False)
-        gtts_obj.save(str(audio_file_path))
+        if deadline is not None:
+            deadline.check('text-to-speech')
+        # gTTS applies its timeout to each request it makes, one per ~100-character chunk, so split
+        # the remaining budget across the chunks. Chunking at punctuation can add a few requests,
+        # so an abandoned save may still overrun the deadline somewhat, but not by a multiple of it.
+        timeout = None
+        if deadline is not None:
+            chunk_count = max(1, math.ceil(len(text) / gTTS.GOOGLE_TTS_MAX_CHARS))
+            timeout = deadline.remaining() / chunk_count
+        gtts_obj = gTTS(text=text, lang='en', slow=False, timeout=timeout)
+        with stage('tts'):
+            (breaker or gtts_breaker).call(gtts_obj.save, str(audio_file_path), deadline=deadline)
         
         print(f'Audio file saved successfully: {audio_file_path}')
         return str(audio_file_path.resolve())
@@ -152,22 +180,32 @@ def generate_audio_from_text(text: str) -> str:
         print(f'Error generating audio from text using gTTS: {e}')
         raise
 
-def generate_story_and_audio(image_path_str: str) -> dict:
+def generate_story_and_audio(image_path_str: str, deadline=None) -> dict:
     """
     Main function to generate both story and audio from an image.
+
+    If text-to-speech fails or its circuit is open, the story is returned without audio
+    (audioPath is None). Deadline and open-circuit errors from story generation are re-raised as-is.
     """
     try:
-        story = generate_story_from_image(image_path_str)
-        audio_path = generate_audio_from_text(story)
-        
-        return {
-            'story': story,
-            'audioPath': audio_path
-        }
+        story = generate_story_from_image(image_path_str, deadline=deadline)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         print(f'Error in generate_story_and_audio: {e}')
         raise ValueError(f'Failed to generate story and audio for {image_path_str}: {e}')
 
+    try:
+        audio_path = generate_audio_from_text(story, deadline=deadline)
+    except Exception as e:
+        print(f'Audio unavailable, returning text-only story: {e}')
+        audio_path = None
+
+    return {
+        'story': story,
+        'audioPath': audio_path
+    }
+
 if __name__ == '__main__':
     print(f'Loading .env from: {ENV_PATH}')
     if not ENV_PATH.exists():
@@ -2,13 +2,17 @@ import os
 import base64
 import mimetypes
 import io
+import math
 from pathlib import Path
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
-from langchain_core.messages import SystemMessage, HumanMessage
 from gtts import gTTS
 import time
+from functools import lru_cache
 from PIL import Image, ImageDraw
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, gtts_breaker
+from utils.profiling import stage
+from utils.prompt_templates import build_story_messages
 
 # Determine the project's backend root directory for loading .env and saving uploads
 # Assumes this script is in backend/utils/
@@ -16,6 +20,14 @@ BACKEND_DIR = Path(__file__).resolve().parent.parent
 ENV_PATH = BACKEND_DIR / '.env'
 UPLOAD_DIR = BACKEND_DIR / 'uploads'
 
+# Circuit breakers for the LLM; calls fail fast while the service is unhealthy.
+# The gTTS breakers are shared with the other provider modules (see utils.resilience).
+nvidia_breaker = CircuitBreaker('nvidia')
+
+# Separate single-worker breaker for background work (prewarming), so it never takes
+# foreground workers and its failures never open the foreground circuit
+nvidia_background_breaker = CircuitBreaker('nvidia-background', max_workers=1)
+
 def image_to_base64(image_path_str: str, max_dimension: int = 800, quality: int = 85) -> str:
     """
     Reads an image file, optimizes it to reduce token size, and converts it to base64 data URI format.
@@ -84,9 +96,25 @@ def image_to_base64(image_path_str: str, max_dimension: int = 800, quality: int
         print(f'Error converting image to base64: {e}')
         raise
 
-def generate_story_from_image(image_path_str: str) -> str:
+@lru_cache(maxsize=1)
+def _get_model():
+    """
+    Initializes the NVIDIA chat model once and reuses it across requests.
+    """
+    # Initialize the LangChain model with NVIDIA configuration
+    model = init_chat_model(
+        'mistralai/mistral-medium-3-instruct',
+        model_provider='nvidia',
+        temperature=0.7,
+        max_output_tokens=32768
+    )
+    print('Initialized LangChain model with init_chat_model and NVIDIA provider')
+    return model
+
+def generate_story_from_image(image_path_str: str, deadline=None, breaker=None) -> str:
     """
     Generates a story based on an image using LangChain and NVIDIA model.
+    Calls go through the foreground circuit breaker unless another breaker is given.
     """
     load_dotenv(dotenv_path=ENV_PATH)
     nvidia_api_key = os.getenv('NVIDIA_API_KEY')
@@ -96,9 +124,12 @@ def generate_story_from_image(image_path_str: str) -> str:
         raise ValueError('Missing NVIDIA_API_KEY. Please add it to your .env file in the backend directory.')
         
     try:
+        if deadline is not None:
+            deadline.check('story generation')
         # Use optimized image processing to reduce token count
         # Smaller dimensions = smaller base64 = fewer tokens
-        base64_image = image_to_base64(image_path_str, max_dimension=600, quality=80)
+        with stage('image_to_base64'):
+            base64_image = image_to_base64(image_path_str, max_dimension=600, quality=80)
         print(f'Successfully converted image to base64: {image_path_str}')
         
         # Check base64 string size as a proxy for token count
@@ -109,30 +140,18 @@ def generate_story_from_image(image_path_str: str) -> str:
         if base64_size_kb > 500:  # ~500KB can be concerning for token limits
             print(f'WARNING: Image base64 size is quite large ({base64_size_kb:.2f} KB). This may exceed token limits.')
 
-        # Initialize the LangChain model with NVIDIA configuration
-        model = init_chat_model(
-            'mistralai/mistral-medium-3-instruct',
-            model_provider='nvidia',
-            temperature=0.7,
-            max_output_tokens=32768
-        )
-        print('Initialized LangChain model with init_chat_model and NVIDIA provider')
-
-        system_prompt_text = (
-           "You are a creative storyteller that creates imaginative, engaging, and family-friendly short stories "
-            "(around 100-300 words) based on images. Create a whimsical, positive narrative that captures the "
-            "essence of the image. Your stories should have a clear beginning, middle, and end, with vivid "
-            "descriptions. Avoid any adult, violent, political, or controversial themes. Keep story not more than 100 words."        )
-
-        human_prompt_text = f'Generate a creative short story based on this image: {base64_image}'
+        model = _get_model()
 
-        messages = [
-            SystemMessage(content=system_prompt_text),
-            HumanMessage(content=human_prompt_text)
-        ]
+        # Send the image as a multimodal block that references the data URI,
+        # instead of concatenating the base64 payload into the prompt text
+        messages = build_story_messages('nvidia', base64_image)
 
         print('Making API call to NVIDIA for story generation...')
-        response = model.invoke(messages)
+        with stage('llm'):
+            # ChatNVIDIA merges invoke kwargs into the request body, so no per-call timeout can be passed
+            # here; the breaker bounds how long we wait, but an abandoned call holds its worker until the
+            # client's own HTTP timeout ends it
+            response = (breaker or nvidia_breaker).call(model.invoke, messages, deadline=deadline)
         print('Successfully received response from NVIDIA API.')
         
         # Clean up memory - important for Render deployment with limited resources
@@ -145,20 +164,33 @@ def generate_story_from_image(image_path_str: str) -> str:
         print(f'Error generating story from image: {e}')
         raise
 
-def generate_audio_from_text(text: str) -> str:
+def generate_audio_from_text(text: str, deadline=None, audio_file_name=None, breaker=None) -> str:
     """
     Generates audio from text using gTTS and saves it to the UPLOAD_DIR.
+    A timestamped file name is used unless audio_file_name is given.
+    Calls go through the foreground circuit breaker unless another breaker is given.
     """
     try:
         print('Initializing gTTS for text-to-speech conversion...')
         UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         
-        timestamp = int(time.time() * 1000)
-        audio_file_name = f'story-{timestamp}.mp3'
+        if audio_file_name is None:
+            timestamp = int(time.time() * 1000)
+            audio_file_name = f'story-{timestamp}.mp3'
         audio_file_path = UPLOAD_DIR / audio_file_name
 
-        gtts_obj = gTTS(text=text, lang='en', slow=False)
-        gtts_obj.save(str(audio_file_path))
+        if deadline is not None:
+            deadline.check('text-to-speech')
+        # gTTS applies its timeout to each request it makes, one per ~100-character chunk, so split
+        # the remaining budget across the chunks. Chunking at punctuation can add a few requests,
+        # so an abandoned save may still overrun the deadline somewhat, but not by a multiple of it.
+        timeout = None
+        if deadline is not None:
+            chunk_count = max(1, math.ceil(len(text) / gTTS.GOOGLE_TTS_MAX_CHARS))
+            timeout = deadline.remaining() / chunk_count
+        gtts_obj = gTTS(text=text, lang='en', slow=False, timeout=timeout)
+        with stage('tts'):
+            (breaker or gtts_breaker).call(gtts_obj.save, str(audio_file_path), deadline=deadline)
         
         print(f'Audio file saved successfully: {audio_file_path}')
         return str(audio_file_path.resolve())
@@ -166,22 +198,32 @@ def generate_audio_from_text(text: str) -> str:
         print(f'Error generating audio from text using gTTS: {e}')
         raise
 
-def generate_story_and_audio(image_path_str: str) -> dict:
+def generate_story_and_audio(image_path_str: str, deadline=None) -> dict:
     """
     Main function to generate both story and audio from an image.
+
+    If text-to-speech fails or its circuit is open, the story is returned without audio
+    (audioPath is None). Deadline and open-circuit errors from story generation are re-raised as-is.
     """
     try:
-        story = generate_story_from_image(image_path_str)
-        audio_path = generate_audio_from_text(story)
-        
-        return {
-            'story': story,
-            'audioPath': audio_path
-        }
+        story = generate_story_from_image(image_path_str, deadline=deadline)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         print(f'Error in generate_story_and_audio: {e}')
         raise ValueError(f'Failed to generate story and audio for {image_path_str}: {e}')
 
+    try:
+        audio_path = generate_audio_from_text(story, deadline=deadline)
+    except Exception as e:
+        print(f'Audio unavailable, returning text-only story: {e}')
+        audio_path = None
+
+    return {
+        'story': story,
+        'audioPath': audio_path
+    }
+
 if __name__ == '__main__':
     print(f'Loading .env from: {ENV_PATH}')
     if not ENV_PATH.exists():
@@ -0,0 +1,206 @@
+import os
+import io
+import sys
+import time
+import hmac
+import random
+import pstats
+import cProfile
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Opt-in, request-scoped profiling for slow generations.
+# A request is profiled when it sends the X-PixTale-Profile header with the shared
+# PROFILE_TOKEN, or is picked by PROFILE_SAMPLE_RATE; otherwise stage() is a no-op.
+
+PROFILE_HEADER = 'X-PixTale-Profile'
+PROFILE_TOKEN_HEADER = 'X-PixTale-Profile-Token'
+PROFILE_MODES = ('stack', 'cprofile')
+PROFILE_HEADER_VALUES = ('1',) + PROFILE_MODES
+
+_current_profile = contextvars.ContextVar('pixtale_request_profile', default=None)
+
+# Only one cProfile profiler can be active at a time; concurrent requests fall back to stack sampling
+_cprofile_lock = threading.Lock()
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+@contextmanager
+def stage(name: str):
+    """
+    Records the wall-clock duration of a pipeline stage for the current profiled request.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile['stages'].append({'name': name, 'ms': round((time.perf_counter() - started) * 1000, 2)})
+
+class _StackSampler:
+    """
+    Samples the call stack of one thread at a fixed wall-clock interval.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, top: int = 20) -> list:
+        self._stop.set()
+        self._thread.join()
+        return [{'stack': stack, 'samples': count} for stack, count in self.samples.most_common(top)]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+class RequestProfiler:
+    """
+    Captures profiles for sampled or explicitly requested requests and keeps the slow ones.
+
+    Args:
+        sample_rate: Fraction of requests profiled without the header (PROFILE_SAMPLE_RATE, default: 0)
+        slow_ms: Sampled requests faster than this are discarded (PROFILE_SLOW_MS, default: 5000)
+        mode: 'stack' for wall-clock stack sampling or 'cprofile' (PROFILE_MODE, default: 'stack')
+        buffer_size: Number of recent profiles kept (PROFILE_BUFFER_SIZE, default: 20)
+        sample_interval: Seconds between stack samples (default: 0.01)
+        token: Shared secret required to trigger profiling by header (PROFILE_TOKEN, default: unset, header disabled)
+    """
+
+    def __init__(self, sample_rate=None, slow_ms=None, mode=None, buffer_size=None, sample_interval=0.01, token=None):
+        self.token = token if token is not None else os.getenv('PROFILE_TOKEN', '')
+        self.sample_rate = sample_rate if sample_rate is not None else _env_float('PROFILE_SAMPLE_RATE', 0)
+        self.slow_ms = slow_ms if slow_ms is not None else _env_float('PROFILE_SLOW_MS', 5000)
+        mode = mode or os.getenv('PROFILE_MODE', 'stack')
+        self.mode = mode if mode in PROFILE_MODES else 'stack'
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        buffer_size = buffer_size if buffer_size is not None else int(_env_float('PROFILE_BUFFER_SIZE', 20))
+        self._profiles = deque(maxlen=max(0, buffer_size))
+        self._next_id = 1
+
+    @contextmanager
+    def profile_request(self, path: str, header_value=None, token=None):
+        """
+        Profiles the enclosed block if the header asks for it or the request is sampled.
+
+        The header value must be '1' (default mode), 'stack' or 'cprofile', and the token must
+        match PROFILE_TOKEN; header triggering is disabled while PROFILE_TOKEN is unset.
+        """
+        if header_value in PROFILE_HEADER_VALUES and self.token_matches(token):
+            trigger = 'header'
+            mode = header_value if header_value in PROFILE_MODES else self.mode
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            trigger = 'sample'
+            mode = self.mode
+        else:
+            yield
+            return
+
+        profiler = None
+        sampler = None
+        if mode == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        else:
+            mode = 'stack'
+            sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+
+        profile = {
+            'path': path,
+            'trigger': trigger,
+            'mode': mode,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'stages': []
+        }
+        context_token = _current_profile.set(profile)
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        else:
+            sampler.start()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _cprofile_lock.release()
+            profile['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            _current_profile.reset(context_token)
+
+            if trigger == 'header' or profile['duration_ms'] >= self.slow_ms:
+                if profiler is not None:
+                    profile['cprofile'] = self._format_cprofile(profiler)
+                else:
+                    profile['stack_samples'] = sampler.stop()
+                self._store(profile)
+                print(f"Stored profile {profile['id']} for {path} ({profile['duration_ms']} ms)")
+            elif sampler is not None:
+                sampler.stop()
+
+    def token_matches(self, token) -> bool:
+        """
+        Returns True if the token matches PROFILE_TOKEN; always False while PROFILE_TOKEN is unset.
+        """
+        if not self.token or not token:
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def list_profiles(self) -> list:
+        """
+        Returns summaries of stored profiles, newest first.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: p[key] for key in ('id', 'path', 'trigger', 'mode', 'started_at', 'duration_ms', 'stages')}
+            for p in reversed(profiles)
+        ]
+
+    def get_profile(self, profile_id: int):
+        """
+        Returns a stored profile with its full cProfile output or stack samples, or None.
+        """
+        with self._lock:
+            for profile in self._profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def _store(self, profile: dict):
+        with self._lock:
+            profile['id'] = self._next_id
+            self._next_id += 1
+            self._profiles.append(profile)
+
+    @staticmethod
+    def _format_cprofile(profiler, top: int = 30) -> str:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+        return stream.getvalue()
+
+# Shared profiler used by the routes and the debug endpoints
+request_profiler = RequestProfiler()
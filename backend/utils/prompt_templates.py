@@ -0,0 +1,69 @@
+import os
+from functools import lru_cache
+from langchain_core.messages import SystemMessage, HumanMessage
+
+# Shared prompt layer for the story providers.
+# Templates are compiled once at import time; only the image block is built per request,
+# and it holds a reference to the data URI instead of copying the base64 payload.
+
+_SYSTEM_PROMPT_TEMPLATE = (
+    "You are a creative storyteller that creates imaginative, engaging, and family-friendly short stories "
+    "({length_hint}) based on images. Create a whimsical, positive narrative that captures the "
+    "essence of the image. Your stories should have a clear beginning, middle, and end, with vivid "
+    "descriptions. Avoid any adult, violent, political, or controversial themes. Keep story not more than 100 words."
+)
+
+SYSTEM_PROMPTS = {
+    'gemini': _SYSTEM_PROMPT_TEMPLATE.format(length_hint='around 300 words'),
+    'nvidia': _SYSTEM_PROMPT_TEMPLATE.format(length_hint='around 100-300 words'),
+}
+
+HUMAN_PROMPT_TEXT = 'Generate a creative short story based on this image:'
+
+# Immutable text block reused by every request
+_HUMAN_TEXT_BLOCK = {"type": "text", "text": HUMAN_PROMPT_TEXT}
+
+# Environment variables naming a provider-side cache that already holds the system prompt
+_CACHED_CONTENT_ENV = {
+    'gemini': 'GEMINI_CACHED_CONTENT',
+}
+
+@lru_cache(maxsize=None)
+def get_system_message(provider: str) -> SystemMessage:
+    """
+    Returns the precompiled SystemMessage for a provider ('gemini' or 'nvidia').
+    """
+    if provider not in SYSTEM_PROMPTS:
+        raise ValueError(f'Unknown story provider: {provider}')
+    return SystemMessage(content=SYSTEM_PROMPTS[provider])
+
+def get_cached_content_name(provider: str):
+    """
+    Returns the name of a provider-side context cache holding the system prompt, or None.
+
+    For Gemini, set GEMINI_CACHED_CONTENT to a cache created with the system prompt as its
+    system instruction (e.g. "cachedContents/abc123"); the system prompt is then omitted from
+    each request instead of being re-sent and re-processed.
+    """
+    env_name = _CACHED_CONTENT_ENV.get(provider)
+    if not env_name:
+        return None
+    return os.getenv(env_name) or None
+
+def build_story_messages(provider: str, image_data_uri: str, use_cached_system_prompt: bool = False) -> list:
+    """
+    Builds the multimodal message list for a story request.
+
+    Args:
+        provider: Story provider name ('gemini' or 'nvidia')
+        image_data_uri: Image as a data URI, as returned by image_to_base64
+        use_cached_system_prompt: Omit the system message because the provider already has it cached
+    """
+    human_message = HumanMessage(content=[
+        _HUMAN_TEXT_BLOCK,
+        {"type": "image_url", "image_url": {"url": image_data_uri}}
+    ])
+
+    if use_cached_system_prompt:
+        return [human_message]
+    return [get_system_message(provider), human_message]
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Per-request deadlines and per-dependency circuit breakers for the generation pipeline.
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of time before or during a pipeline stage."""
+
+class CircuitOpenError(Exception):
+    """Raised when a dependency's circuit breaker is open and calls are rejected."""
+
+class Deadline:
+    """
+    Absolute point in time by which a request must finish.
+
+    Args:
+        seconds: Time budget from now, or None for no deadline
+    """
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    @classmethod
+    def from_env(cls, env_name: str = 'GENERATE_DEADLINE_SECONDS', default: float = 60):
+        """
+        Creates a deadline from an environment variable (default: GENERATE_DEADLINE_SECONDS, 60s; 0 disables it).
+        """
+        try:
+            seconds = float(os.getenv(env_name, default))
+        except ValueError:
+            seconds = default
+        return cls(seconds if seconds > 0 else None)
+
+    def remaining(self):
+        """
+        Returns the seconds left, or None if there is no deadline.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage: str):
+        """
+        Raises DeadlineExceeded if the deadline has passed before starting a stage.
+        """
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f'Deadline exceeded before {stage}')
+
+class CircuitBreaker:
+    """
+    Fails fast for a dependency after repeated failures, probing it again after a cool-down.
+
+    Calls run on a small dedicated thread pool so that a hung client blocks at most
+    max_workers threads, and callers stop waiting once their deadline passes. Callers must
+    also pass the remaining time to the client itself so abandoned calls eventually finish.
+
+    Args:
+        name: Dependency name used in logs and errors
+        failure_threshold: Consecutive failures that open the circuit (default: 5)
+        reset_timeout: Seconds the circuit stays open before a probe call is allowed (default: 30)
+        max_workers: Concurrent calls allowed to the dependency (default: 4)
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, max_workers: int = 4):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-call')
+        self._lock = threading.Lock()
+        self._active = 0  # submitted calls not yet finished, including abandoned ones
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) through the breaker, bounded by the deadline if given.
+        """
+        self._before_call()
+        timeout = deadline.remaining() if deadline is not None else None
+        if timeout == 0:
+            self._release_probe()
+            raise DeadlineExceeded(f'Deadline exceeded before calling {self.name}')
+
+        with self._lock:
+            self._active += 1
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._call_finished)
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._record_failure()
+            raise DeadlineExceeded(f'{self.name} did not respond within {timeout:.1f}s')
+        except Exception:
+            self._record_failure()
+            raise
+        self._record_success()
+        return result
+
+    def _before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError(f'{self.name} is unavailable (circuit open)')
+            # Half-open: a probe queued behind hung calls would only time out, so reject it
+            if self._active >= self.max_workers:
+                raise CircuitOpenError(f'{self.name} is unavailable (all workers busy)')
+            # Half-open: let a single probe call through
+            self._probing = True
+
+    def _call_finished(self, future):
+        with self._lock:
+            self._active -= 1
+
+    def _release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def _record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f'Circuit for {self.name} closed')
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    print(f'Circuit for {self.name} opened after {self._failures} failures')
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+# gTTS breakers shared by every provider module, so one gTTS outage opens a single circuit.
+# The background breaker has one worker, so background synthesis never takes foreground capacity.
+gtts_breaker = CircuitBreaker('gtts')
+gtts_background_breaker = CircuitBreaker('gtts-background', max_workers=1)
@@ -0,0 +1,200 @@
+import os
+import time
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Background prewarming of story variants for frequently requested images.
+# Disabled unless PREWARM_ENABLED is set; all state is in-process memory.
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+def image_digest(content: bytes) -> str:
+    """
+    Returns a stable digest identifying the uploaded image bytes.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+class StoryPrewarmer:
+    """
+    Keeps a small pool of ready story-and-audio variants for hot image digests.
+
+    Args:
+        generate_fn: Callable taking an image path and returning a story variant dict
+        pool_size: Ready variants kept per hot image (PREWARM_POOL_SIZE, default: 2)
+        min_hits: Requests within the stats window before an image counts as hot (PREWARM_MIN_HITS, default: 3)
+        window_seconds: Request-frequency window (PREWARM_WINDOW_SECONDS, default: 3600)
+        max_images: Maximum number of hot images prewarmed at once (PREWARM_MAX_IMAGES, default: 5)
+        cpu_fraction: Share of wall time the worker may spend generating (PREWARM_CPU_FRACTION, default: 0.25)
+        hourly_quota: Maximum prewarm generations per hour (PREWARM_HOURLY_QUOTA, default: 20)
+    """
+
+    def __init__(self, generate_fn, pool_size=None, min_hits=None, window_seconds=None,
+                 max_images=None, cpu_fraction=None, hourly_quota=None, enabled=None):
+        self.generate_fn = generate_fn
+        self.enabled = enabled if enabled is not None else os.getenv('PREWARM_ENABLED', '').lower() in ('1', 'true', 'yes')
+        self.pool_size = pool_size if pool_size is not None else _env_int('PREWARM_POOL_SIZE', 2)
+        self.min_hits = min_hits if min_hits is not None else _env_int('PREWARM_MIN_HITS', 3)
+        self.window_seconds = window_seconds if window_seconds is not None else _env_float('PREWARM_WINDOW_SECONDS', 3600)
+        self.max_images = max_images if max_images is not None else _env_int('PREWARM_MAX_IMAGES', 5)
+        cpu_fraction = cpu_fraction if cpu_fraction is not None else _env_float('PREWARM_CPU_FRACTION', 0.25)
+        self.cpu_fraction = min(max(cpu_fraction, 0.01), 1.0)
+        self.hourly_quota = hourly_quota if hourly_quota is not None else _env_int('PREWARM_HOURLY_QUOTA', 20)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._hits = {}            # digest -> deque of request timestamps
+        self._image_paths = {}     # digest -> latest saved image path
+        self._pools = {}           # digest -> deque of ready variants
+        self._quota_log = deque()  # timestamps of prewarm generations in the last hour
+        self._foreground = 0
+        self._worker = None
+        self._stats = {'pool_hits': 0, 'pool_misses': 0, 'generated': 0, 'failed': 0}
+
+    def record_request(self, digest: str, image_path: str):
+        """
+        Records a foreground request for an image and wakes the worker if it may need a refill.
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.setdefault(digest, deque())
+            hits.append(now)
+            self._trim(hits, now)
+            self._image_paths[digest] = image_path
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def take_variant(self, digest: str):
+        """
+        Pops a ready variant for the image, or returns None if the pool is empty.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            pool = self._pools.get(digest)
+            if pool:
+                self._stats['pool_hits'] += 1
+                variant = pool.popleft()
+            else:
+                self._stats['pool_misses'] += 1
+                variant = None
+        if variant is not None:
+            self._wakeup.set()
+        return variant
+
+    @contextmanager
+    def foreground(self):
+        """
+        Marks a foreground generation in flight; the worker only runs while none are.
+        """
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+            self._wakeup.set()
+
+    def status(self) -> dict:
+        """
+        Returns a snapshot of prewarm configuration and pool state for debugging.
+        """
+        now = time.monotonic()
+        with self._lock:
+            hot = self._hot_digests(now)
+            return {
+                'enabled': self.enabled,
+                'pool_size': self.pool_size,
+                'cpu_fraction': self.cpu_fraction,
+                'hourly_quota': self.hourly_quota,
+                'quota_used': len(self._quota_log),
+                'hot_images': [{'digest': d[:12], 'ready': len(self._pools.get(d, ()))} for d in hot],
+                **self._stats
+            }
+
+    def _trim(self, hits: deque, now: float):
+        while hits and now - hits[0] > self.window_seconds:
+            hits.popleft()
+
+    def _hot_digests(self, now: float) -> list:
+        # Caller holds the lock
+        counts = []
+        for digest, hits in list(self._hits.items()):
+            self._trim(hits, now)
+            if not hits:
+                del self._hits[digest]
+                self._image_paths.pop(digest, None)
+                self._pools.pop(digest, None)
+            elif len(hits) >= self.min_hits:
+                counts.append((len(hits), digest))
+        counts.sort(reverse=True)
+        return [digest for _, digest in counts[:self.max_images]]
+
+    def _next_job(self):
+        # Picks the hottest image with room in its pool, or None if there is no work or budget
+        now = time.monotonic()
+        with self._lock:
+            if self._foreground:
+                return None
+            while self._quota_log and now - self._quota_log[0] > 3600:
+                self._quota_log.popleft()
+            if len(self._quota_log) >= self.hourly_quota:
+                return None
+            hot = self._hot_digests(now)
+            for digest in list(self._pools):
+                if digest not in hot:
+                    del self._pools[digest]
+            for digest in hot:
+                if len(self._pools.get(digest, ())) < self.pool_size:
+                    image_path = self._image_paths.get(digest)
+                    if image_path and os.path.isfile(image_path):
+                        self._quota_log.append(now)
+                        return digest, image_path
+        return None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='story-prewarm', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.wait(timeout=30)
+                self._wakeup.clear()
+                continue
+
+            digest, image_path = job
+            started = time.monotonic()
+            try:
+                print(f'Prewarming story variant for image {digest[:12]}')
+                variant = self.generate_fn(image_path)
+                with self._lock:
+                    if digest in self._image_paths:
+                        self._pools.setdefault(digest, deque()).append(variant)
+                    self._stats['generated'] += 1
+            except Exception as e:
+                print(f'Error prewarming story variant: {e}')
+                with self._lock:
+                    self._stats['failed'] += 1
+
+            # Stay within the CPU budget by idling in proportion to the time just spent working
+            elapsed = time.monotonic() - started
+            time.sleep(elapsed * (1 - self.cpu_fraction) / self.cpu_fraction)